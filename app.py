@@ -1,13 +1,24 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
+import orjson
 import duckdb
+import pyarrow as pa
 import os
-import json
-from tempfile import NamedTemporaryFile
+import sys
+import secrets
 import re
+import hashlib
+import threading
+from tempfile import NamedTemporaryFile
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel, ValidationError
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -17,48 +28,508 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY not found. Please set it in your .env file.")
 
+class OrjsonProvider(JSONProvider):
+    """Serializes JSON with orjson, which is much faster than the standard library on large results.
+
+    Values orjson doesn't support natively, such as Decimal, are converted with str(),
+    as Flask's default provider does. Dates and times, however, are written in ISO 8601
+    ("2024-01-01T10:00:00") rather than as Flask's HTTP dates ("Mon, 01 Jan 2024
+    10:00:00 GMT"), so DATE and TIMESTAMP values in previews and results are ISO strings.
+    NaN and infinity are written as null.
+    """
+
+    @staticmethod
+    def _embed_big_ints(value):
+        """Replaces integers beyond orjson's 64-bit range with raw JSON numbers."""
+        if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 64:
+            return orjson.Fragment(str(value))
+        if isinstance(value, dict):
+            return {key: OrjsonProvider._embed_big_ints(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [OrjsonProvider._embed_big_ints(item) for item in value]
+        return value
+
+    @staticmethod
+    def _dumps_bytes(obj):
+        try:
+            return orjson.dumps(obj, default=str)
+        except orjson.JSONEncodeError:
+            # orjson rejects integers beyond 64 bits, such as large HUGEINT sums.
+            # Embed those as raw numbers and encode again, so the output keeps
+            # exactly the same format as every other response.
+            return orjson.dumps(OrjsonProvider._embed_big_ints(obj), default=str)
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype="application/json")
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
-# A global dictionary to store the database connection for the session.
-# This will persist across different requests.
-db_session = {}
+# Compress large responses (previews and query results) with Brotli or gzip.
+# Streamed responses are left alone so SSE events reach the client as they are sent.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 4096
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+
+# Session limits: how many sessions are kept, how long an idle session lives,
+# and the total size of uploaded files and cached results that may be held at once.
+MAX_SESSIONS = 32
+SESSION_TTL_SECONDS = 3600
+SESSION_SIZE_BUDGET = int(os.getenv("SESSION_SIZE_BUDGET", 2 * 1024 ** 3))
+
+def close_session(session_data):
+    """Closes a session's DuckDB connection and deletes its temporary files."""
+    # Wait for any query still running on the connection before closing it
+    with session_data['lock']:
+        session_data['con'].close()
+
+    file_path = session_data['file_path']
+    db_file_path = session_data['db_file_path']
+
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    if os.path.exists(db_file_path):
+        os.remove(db_file_path)
+
+def session_size(session_data):
+    """Returns the bytes a session holds: its uploaded file plus its cached results."""
+    return session_data['size'] + session_data['result_cache'].currsize
+
+class SessionCache(TTLCache):
+    """A TTL/LRU cache of sessions that collects the sessions it evicts.
+
+    Besides the session count and TTL limits, the largest sessions are evicted
+    whenever the total size of the uploaded files and cached results exceeds the
+    size budget.
+    Evicted sessions are closed by the caller through take_evicted(), after
+    the cache lock is released, since closing waits for running queries.
+    """
+
+    def __init__(self, maxsize, ttl, size_budget):
+        super().__init__(maxsize, ttl)
+        self.size_budget = size_budget
+        self.evicted = []
+
+    def popitem(self):
+        key, session_data = super().popitem()
+        self.evicted.append(session_data)
+        return key, session_data
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.evicted.extend(session_data for _, session_data in expired)
+        return expired
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        sizes = {k: session_size(v) for k, v in list(self.items()) if k != key}
+        while sizes and sum(sizes.values()) + session_size(value) > self.size_budget:
+            largest = max(sizes, key=sizes.get)
+            del sizes[largest]
+            self.evicted.append(self.pop(largest))
+
+    def take_evicted(self):
+        """Returns the sessions evicted since the last call and forgets them."""
+        evicted, self.evicted = self.evicted, []
+        return evicted
+
+# A global cache to store the database connection for the session.
+# This will persist across different requests until the session is evicted.
+# Requests run on several threads, so every access holds db_session_lock.
+db_session = SessionCache(MAX_SESSIONS, SESSION_TTL_SECONDS, SESSION_SIZE_BUDGET)
+db_session_lock = threading.RLock()
+
+def get_session(session_id):
+    """Returns the data for a session, or None if it does not exist or has expired."""
+    if not session_id:
+        return None
+    with db_session_lock:
+        # Reads alone don't expire entries, so collect idle sessions here too
+        db_session.expire()
+        session_data = db_session.get(session_id)
+        if session_data is not None:
+            # Storing it again restarts the TTL, so only idle sessions expire
+            db_session[session_id] = session_data
+        evicted = db_session.take_evicted()
+    for evicted_session in evicted:
+        close_session(evicted_session)
+    return session_data
+
+def add_session(session_id, session_data):
+    """Stores a new session, closing any sessions evicted to make room for it."""
+    with db_session_lock:
+        db_session[session_id] = session_data
+        evicted = db_session.take_evicted()
+    for evicted_session in evicted:
+        close_session(evicted_session)
+
+def remove_session(session_id):
+    """Removes a session and returns its data, or None if it does not exist."""
+    with db_session_lock:
+        db_session.expire()
+        session_data = db_session.pop(session_id, None)
+        evicted = db_session.take_evicted()
+    for evicted_session in evicted:
+        close_session(evicted_session)
+    return session_data
+
+# Generated SQL keyed by (table name, schema hash, normalized question), shared
+# across sessions so repeated questions skip the LLM round-trip entirely. The
+# least recently used entries are dropped once the cache is full.
+SQL_CACHE_SIZE = 1024
+sql_cache = LRUCache(maxsize=SQL_CACHE_SIZE)
+sql_cache_lock = threading.Lock()
+
+def get_cached_sql(cache_key):
+    """Returns the cached (sql_query, explanation) for a cache key, or None."""
+    with sql_cache_lock:
+        return sql_cache.get(cache_key)
+
+def cache_sql(cache_key, sql_query, explanation):
+    """Stores a generated SQL query and its explanation in the cache."""
+    with sql_cache_lock:
+        sql_cache[cache_key] = (sql_query, explanation)
+
+# Query results each session keeps for repeated queries, bounded by their
+# estimated size in bytes. Cached results also count toward SESSION_SIZE_BUDGET.
+RESULT_CACHE_BYTES = 64 * 1024 ** 2
+
+def result_size(results):
+    """Estimates the memory held by a query result, in bytes."""
+    if isinstance(results, pa.Table):
+        return results.nbytes
+    return sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in results)
+
+def available_memory_bytes():
+    """Returns the memory this process may use: the cgroup limit if lower than physical RAM."""
+    if not hasattr(os, "sysconf"):
+        return None
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    # cgroup v2, then v1; an unlimited cgroup reports "max" or a huge number
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as limit_file:
+                limit = limit_file.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            memory = min(memory, int(limit))
+        break
+    return memory
+
+# DuckDB settings for every session database. Threads default to the CPUs this
+# process may run on (not the host's total). Every session has its own database,
+# and DuckDB's default memory limit is 80% of RAM for each one, so by default the
+# process's memory is split across MAX_SESSIONS (with a 64 MiB floor).
+# DUCKDB_MEMORY_LIMIT overrides it, e.g. DUCKDB_MEMORY_LIMIT=256MB.
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+MIN_SESSION_MEMORY_BYTES = 64 * 1024 ** 2
+AVAILABLE_MEMORY_BYTES = available_memory_bytes()
+DUCKDB_CONFIG = {"threads": int(os.getenv("DUCKDB_THREADS", CPU_COUNT))}
+if os.getenv("DUCKDB_MEMORY_LIMIT"):
+    DUCKDB_CONFIG["memory_limit"] = os.getenv("DUCKDB_MEMORY_LIMIT")
+elif AVAILABLE_MEMORY_BYTES:
+    session_memory = max(AVAILABLE_MEMORY_BYTES // MAX_SESSIONS, MIN_SESSION_MEMORY_BYTES)
+    DUCKDB_CONFIG["memory_limit"] = f"{session_memory // 1024 ** 2}MiB"
+
+# Table names must be plain SQL identifiers of at most 64 characters, and must not
+# be keywords that DuckDB only accepts quoted (e.g. "order", "group", "table")
+TABLE_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]{0,63}')
+with duckdb.connect() as keyword_con:
+    RESERVED_KEYWORDS = frozenset(
+        row[0] for row in keyword_con.execute(
+            "SELECT keyword_name FROM duckdb_keywords() WHERE keyword_category IN ('reserved', 'type_function')"
+        ).fetchall()
+    )
+
+# Generated queries are capped at this many rows, and any query
+# still running after the timeout is interrupted.
+MAX_RESULT_ROWS = 1000
+QUERY_TIMEOUT_SECONDS = 10
+
+# Form values accepted as "true" for boolean fields such as execute_sql
+TRUE_FORM_VALUES = {"true", "1", "yes"}
+
+# Clients that send this Accept header get tabular results as an Arrow IPC stream
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
 
 def get_db_info(file_path, table_name):
     """Creates and returns a DuckDB connection and the table name."""
+    con = None
+    db_file_path = None
     try:
         # Determine the correct reading function based on file extension
         file_ext = os.path.splitext(file_path)[1].lower()
         
-        # Use a temporary, file-based DuckDB database
-        db_file_path = file_path.replace(file_ext, '.duckdb')
-        con = duckdb.connect(database=db_file_path, read_only=False)
-        
         if file_ext == '.csv':
-            read_function = f"read_csv_auto('{file_path}')"
+            # DuckDB's native, multi-threaded CSV reader loads the file straight into
+            # columnar storage. The path is bound as a parameter so it is never
+            # spliced into the SQL text.
+            read_function = "read_csv_auto(?)"
         
         else:
             raise Exception(f"Unsupported file format: {file_ext}")
+
+        # Use a temporary, file-based DuckDB database. The connection is kept open
+        # for the whole session and reused by every query.
+        db_file_path = file_path.replace(file_ext, '.duckdb')
+        con = duckdb.connect(database=db_file_path, read_only=False, config=DUCKDB_CONFIG)
             
-        con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM {read_function}")
+        con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM {read_function}", [file_path])
         return con, table_name, db_file_path
     except Exception as e:
+        # Don't leak the connection or leave a half-built database file behind
+        if con is not None:
+            con.close()
+        if db_file_path and os.path.exists(db_file_path):
+            os.remove(db_file_path)
         raise Exception(f"Failed to create database from file: {str(e)}")
 
-def format_schema_for_prompt(con, table_name):
-    """Retrieves and formats the table schema for the LLM prompt."""
+def format_schema_for_prompt(table_name, columns):
+    """Formats the table schema for the LLM prompt from the columns read at upload."""
+    formatted_schema = f"Table '{table_name}' has the following columns:\n"
+    for column in columns:
+        formatted_schema += f"- {column['name']} ({column['type']})\n"
+    return formatted_schema
+
+def execute_query(con, sql_query, as_arrow=False, max_rows=None):
+    """Executes a query and returns the results (headers first, or an Arrow table) and any execution error.
+
+    With max_rows, at most that many rows are fetched whatever LIMIT the query has.
+    """
+    # DuckDB has no statement timeout setting, so interrupt the connection from a timer
+    timer = threading.Timer(QUERY_TIMEOUT_SECONDS, con.interrupt)
+    timer.start()
     try:
-        schema_query = f"PRAGMA table_info('{table_name}')"
-        schema = con.execute(schema_query).fetchall()
-        
-        formatted_schema = f"Table '{table_name}' has the following columns:\n"
-        for row in schema:
-            col_name = row[1]
-            col_type = row[2]
-            formatted_schema += f"- {col_name} ({col_type})\n"
-        return formatted_schema
+        if max_rows is None:
+            # Execute the query and get the result cursor
+            cursor = con.execute(sql_query)
+        else:
+            # Cap the query through the relation API rather than by editing its text,
+            # so trailing semicolons, comments and CTEs need no special handling
+            relation = con.sql(sql_query)
+            if relation is None:
+                return None, "The query did not return any rows."
+            cursor = relation.limit(max_rows)
+
+        # Arrow clients get the columnar result as-is, without building Python rows
+        if as_arrow:
+            return cursor.to_arrow_table(), None
+
+        # Get the column names from the cursor's description, which always exists
+        headers = [desc[0] for desc in cursor.description]
+
+        # Fetch the rows with fetchall(), which keeps DuckDB's Python types: HUGEINT
+        # sums stay ints and intervals stay timedeltas, unlike Arrow's to_pylist()
+        rows = cursor.fetchall()
+
+        # Combine headers and rows for the final result
+        return [headers] + rows, None
+    except duckdb.InterruptException:
+        return None, f"Query was stopped after exceeding the {QUERY_TIMEOUT_SECONDS} second time limit."
     except Exception as e:
-        return f"Could not retrieve schema: {str(e)}"
+        return None, str(e)
+    finally:
+        timer.cancel()
+
+def schema_query_response(con, table_name, as_arrow=False):
+    """Builds the response for schema-related questions without calling the LLM."""
+    # This is the query that will be shown to the user in the UI.
+    sql_display = f"DESCRIBE {table_name};"
+    # This is the query that will be executed by DuckDB, prepared when the session was created.
+    sql_execution = "EXECUTE schema_info"
+    explanation = f"This query retrieves the schema for the '{table_name}' table, showing column names, data types, and other properties."
+    results, execution_error = execute_query(con, sql_execution, as_arrow)
+
+    return {
+        "status": "success",
+        "sql_query": sql_display,
+        "explanation": explanation,
+        "results": results,
+        "execution_error": execution_error
+    }
+
+def sql_query_response(con, result_cache, sql_query, explanation, execute_sql, as_arrow=False):
+    """Builds the response for a generated query, executing it when requested.
+
+    Uploaded data never changes within a session, so successful results are
+    kept in the session's result cache and reused for repeated queries.
+    """
+    results = None
+    execution_error = None
+    if execute_sql and sql_query and "Error" not in sql_query:
+        cache_key = (sql_query.strip(), as_arrow)
+        results = result_cache.get(cache_key)
+        if results is None:
+            results, execution_error = execute_query(con, sql_query, as_arrow, max_rows=MAX_RESULT_ROWS)
+            # Results larger than the whole cache are served without being cached
+            if execution_error is None and result_size(results) <= result_cache.maxsize:
+                result_cache[cache_key] = results
+
+    return {
+        "status": "success",
+        "sql_query": sql_query,
+        "explanation": explanation,
+        "results": results,
+        "execution_error": execution_error
+    }
+
+class SQLResponse(BaseModel):
+    """The structured response expected from the LLM."""
+    sql_query: str
+    explanation: str
+
+# The prompt is static, so it is built once at import time. It is kept short
+# because every input token adds to the time-to-first-token of each request.
+SQL_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system",
+            "Generate one DuckDB SELECT query answering the question about table '{table_name}', "
+            "and a short explanation of what it does.\n"
+            "Schema:\n{schema}\n"
+            "Enclose column names containing spaces or special characters in double quotes.\n"
+            "Respond with a JSON object with the keys `sql_query` and `explanation`."),
+        ("human", "{question}")
+    ]
+)
+
+# A single LLM client shared by all requests, so the underlying HTTP connection
+# pool (and its TLS sessions to the Groq API) is reused between questions.
+# JSON mode makes Groq return a bare JSON object, with no markdown fences to strip.
+LLM = ChatGroq(
+    model="llama-3.1-8b-instant",
+    temperature=0,
+    groq_api_key=GROQ_API_KEY,
+    max_retries=2,
+    model_kwargs={"response_format": {"type": "json_object"}}
+)
+
+# The prompt, LLM and JSON parser chain that translates questions into SQL
+SQL_PARSER = JsonOutputParser(pydantic_object=SQLResponse)
+SQL_CHAIN = SQL_PROMPT | LLM | SQL_PARSER
+
+# The streaming variant also collects the raw text next to the parsed partial
+# objects, so output that never parses as JSON can still be reported
+SQL_STREAM_CHAIN = SQL_PROMPT | LLM | {"raw": StrOutputParser(), "parsed": SQL_PARSER}
+
+# Maximum number of LLM calls /ask_batch has in flight at once, and the most
+# questions one batch may contain. Each question can cost an LLM call and a query
+# that holds the session lock, so larger batches are rejected.
+BATCH_MAX_CONCURRENCY = 10
+MAX_BATCH_QUESTIONS = 20
+
+def parse_llm_response(output):
+    """Validates the parsed LLM output and returns the SQL query and explanation."""
+    try:
+        parsed_response = SQLResponse.model_validate(output)
+        return parsed_response.sql_query, parsed_response.explanation
+    except ValidationError:
+        return "Error generating SQL.", f"LLM returned invalid JSON. Response was: {output}"
+
+# Keywords that mark a question as schema-related, matched in a single pass
+SCHEMA_RE = re.compile(r'\b(?:schema|columns|data\s*types|table\s*info|structure|describe)\b', re.IGNORECASE)
+
+def is_schema_question(question):
+    """Checks whether the question asks about the table schema."""
+    return SCHEMA_RE.search(question) is not None
+
+def normalize_question(question):
+    """Collapses whitespace and drops trailing sentence punctuation from a question."""
+    return " ".join(question.split()).rstrip("?.! ")
+
+def sql_cache_key(table_name, schema_hash, question):
+    """Builds the SQL cache key for a question asked against a given table schema."""
+    # Normalizing lets trivially different phrasings of the same question share an
+    # entry. Casing is kept: the LLM sees it, and it can change the generated SQL
+    # (e.g. a string literal such as 'Bob' vs 'BOB').
+    return (table_name, schema_hash, normalize_question(question))
+
+def quote_identifier(name):
+    """Quotes a column or table name for use in DuckDB SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+AGGREGATE_FUNCTIONS = {
+    "min": "MIN", "minimum": "MIN", "max": "MAX", "maximum": "MAX",
+    "average": "AVG", "avg": "AVG", "mean": "AVG", "sum": "SUM", "total": "SUM"
+}
+
+# Common questions answered from SQL templates without calling the LLM, tried in
+# order against the normalized, lowercased question. A "column" group must name a
+# column of the table, otherwise the question falls through to the LLM.
+FAST_PATH_QUERIES = [
+    (re.compile(r'how many (?:rows|records)(?: are there)?(?: in (?:the |this )?(?:table|dataset|data))?'),
+        "SELECT COUNT(*) AS row_count FROM {table}",
+        "This query counts the total number of rows in the '{table}' table."),
+    (re.compile(r'(?:(?:show|display|list|get)\s+)?(?:me\s+)?(?:the\s+)?(?:first|top|head)\s+(?P<n>\d+)(?:\s+(?:rows|records))?'),
+        "SELECT * FROM {table} LIMIT {n}",
+        "This query returns the first {n} rows of the '{table}' table."),
+    (re.compile(r'(?:(?:show|list|get|what are)\s+)?(?:me\s+)?(?:the\s+)?(?:unique|distinct)\s+values\s+(?:of|in|for)\s+(?:the\s+)?(?P<column>.+?)(?:\s+column)?'),
+        "SELECT DISTINCT {column} FROM {table}",
+        "This query lists the distinct values of the '{column_name}' column in the '{table}' table."),
+    (re.compile(r'(?:what is\s+)?(?:the\s+)?(?P<func>min|minimum|max|maximum|average|avg|mean|sum|total)\s+(?:value\s+)?(?:of|in|for)\s+(?:the\s+)?(?P<column>.+?)(?:\s+column)?'),
+        "SELECT {func}({column}) FROM {table}",
+        "This query computes the {func} of the '{column_name}' column in the '{table}' table."),
+]
+
+def match_fast_path(question, table_name, columns):
+    """Returns the templated SQL query and explanation for a common question, or None."""
+    # The templates contain no literals from the question, so case can be ignored here
+    normalized_question = normalize_question(question).lower()
+    for pattern, sql_template, explanation_template in FAST_PATH_QUERIES:
+        match = pattern.fullmatch(normalized_question)
+        if not match:
+            continue
+
+        values = {"table": table_name}
+        groups = match.groupdict()
+        if groups.get("n"):
+            values["n"] = min(int(groups["n"]), MAX_RESULT_ROWS)
+        if groups.get("func"):
+            values["func"] = AGGREGATE_FUNCTIONS[groups["func"]]
+        if groups.get("column"):
+            column = next((c["name"] for c in columns if c["name"].lower() == groups["column"]), None)
+            if column is None:
+                continue
+            values["column"] = quote_identifier(column)
+            values["column_name"] = column
+
+        return sql_template.format(**values), explanation_template.format(**values)
+    return None
+
+def wants_arrow():
+    """Checks whether the client asked for an Arrow IPC stream instead of JSON."""
+    return request.accept_mimetypes.best_match(["application/json", ARROW_STREAM_MIMETYPE]) == ARROW_STREAM_MIMETYPE
+
+def arrow_response(payload, table_key):
+    """Sends the Arrow table in payload[table_key] as an Arrow IPC stream.
+
+    The remaining payload fields travel in the schema metadata, JSON-encoded
+    unless they are already strings.
+    """
+    metadata = {
+        key: value if isinstance(value, str) else app.json.dumps(value)
+        for key, value in payload.items() if key != table_key
+    }
+    table = payload[table_key]
+    table = table.replace_schema_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), mimetype=ARROW_STREAM_MIMETYPE)
+
+def sse_event(payload):
+    """Formats a payload as a Server-Sent Events message."""
+    return f"data: {app.json.dumps(payload)}\n\n"
 
 @app.route("/")
 def home():
@@ -78,31 +549,61 @@ def upload_file():
         return jsonify({"status": "error", "message": "No file selected."}), 400
     if not table_name:
         return jsonify({"status": "error", "message": "Table name not provided."}), 400
+    # The table name is interpolated into SQL, so only plain identifiers are accepted
+    if not TABLE_NAME_RE.fullmatch(table_name):
+        return jsonify({"status": "error", "message": "Invalid table name. Use up to 64 letters, digits and underscores, starting with a letter or underscore."}), 400
+    if table_name.lower() in RESERVED_KEYWORDS:
+        return jsonify({"status": "error", "message": f"'{table_name}' is a reserved SQL keyword. Please choose a different table name."}), 400
 
     temp_file_path = None
+    con = None
+    db_file_path = None
     try:
         file_ext = os.path.splitext(file.filename)[1]
+        # Copy the upload to disk in 1 MiB chunks; DuckDB then reads it straight
+        # from the file, so the CSV is never held in memory as a whole.
         with NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            file.save(temp_file.name)
+            file.save(temp_file, buffer_size=1 << 20)
             temp_file_path = temp_file.name
 
         con, table_name_actual, db_file_path = get_db_info(temp_file_path, table_name)
         
-        columns = [{"name": row[1], "type": row[2]} for row in con.execute(f"PRAGMA table_info('{table_name_actual}')").fetchall()]
+        columns = [{"name": row[0], "type": row[1]} for row in con.execute(f"DESCRIBE {table_name_actual}").fetchall()]
         
         # Get total row count
         total_rows = con.execute(f"SELECT COUNT(*) FROM {table_name_actual}").fetchone()[0]
-        preview_data = con.execute(f"SELECT * FROM {table_name_actual} LIMIT 20").fetchall()
+        # Arrow clients get the preview as a table; JSON rows come from fetchall(),
+        # which keeps the same Python types as query results
+        preview_cursor = con.execute(f"SELECT * FROM {table_name_actual} LIMIT 20")
+        as_arrow = wants_arrow()
+        preview_data = preview_cursor.to_arrow_table() if as_arrow else preview_cursor.fetchall()
+
+        # The schema is fixed for the lifetime of the session, so format it once here
+        # instead of re-querying it on every question. DESCRIBE above already
+        # returned the names and types, so no second catalog lookup is needed.
+        schema_prompt = format_schema_for_prompt(table_name_actual, columns)
+
+        # Prepare the schema lookup once, so schema questions skip parsing and planning
+        con.execute(f"PREPARE schema_info AS SELECT * FROM PRAGMA_TABLE_INFO('{table_name_actual}')")
         
-        session_id = os.urandom(16).hex()
-        db_session[session_id] = {
+        # The session id is the only credential for a session, so keep 128 bits of randomness
+        session_id = secrets.token_urlsafe(16)
+        add_session(session_id, {
             'con': con, 
+            # DuckDB connections are not safe for concurrent use, so queries
+            # from simultaneous requests on one session are serialized
+            'lock': threading.Lock(),
             'file_path': temp_file_path, 
             'db_file_path': db_file_path,
-            'table_name': table_name_actual
-        }
+            'table_name': table_name_actual,
+            'columns': columns,
+            'schema_prompt': schema_prompt,
+            'schema_hash': hashlib.sha1(schema_prompt.encode()).hexdigest(),
+            'result_cache': LRUCache(maxsize=RESULT_CACHE_BYTES, getsizeof=result_size),
+            'size': os.path.getsize(temp_file_path)
+        })
 
-        return jsonify({
+        response = {
             "status": "success",
             "message": "File uploaded and schema read successfully.",
             "session_id": session_id,
@@ -110,8 +611,15 @@ def upload_file():
             "total_rows": total_rows,
             "preview_data": preview_data,
             "table_name": table_name_actual
-        })
+        }
+        if as_arrow:
+            return arrow_response(response, "preview_data")
+        return jsonify(response)
     except Exception as e:
+        if con is not None:
+            con.close()
+        if db_file_path and os.path.exists(db_file_path):
+            os.remove(db_file_path)
         if temp_file_path and os.path.exists(temp_file_path):
             os.remove(temp_file_path)
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -119,122 +627,186 @@ def upload_file():
 @app.route("/ask", methods=["POST"])
 def ask_query():
     """Processes a natural language query and returns SQL, explanation, and results."""
-    question = request.form.get("question", "").lower()  # Convert to lowercase for case-insensitive matching
+    # Keep the original casing for the LLM; keyword checks are case-insensitive
+    question = request.form.get("question", "")
     session_id = request.form.get("session_id")
-    execute_sql_str = request.form.get("execute_sql", "false")
-    execute_sql = execute_sql_str.lower() == 'true'
+    execute_sql = request.form.get("execute_sql", "").lower() in TRUE_FORM_VALUES
 
-    if not session_id or session_id not in db_session:
+    session_data = get_session(session_id)
+    if session_data is None:
         return jsonify({"status": "error", "message": "Session not found. Please upload a dataset first."}), 404
 
-    session_data = db_session[session_id]
     con = session_data['con']
     table_name = session_data['table_name']
     
     # Check for schema-related queries and bypass the LLM
-    schema_keywords = ["schema", "columns", "data types", "table info", "structure", "describe"]
-    if any(word in question for word in schema_keywords):
-        # This is the query that will be shown to the user in the UI.
-        sql_display = f"DESCRIBE {table_name};"
-        # This is the query that will be executed by DuckDB.
-        sql_execution = f"SELECT * FROM PRAGMA_TABLE_INFO('{table_name}')"
-        explanation = f"This query retrieves the schema for the '{table_name}' table, showing column names, data types, and other properties."
-        try:
-            cursor = con.execute(sql_execution)
-            headers = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            results = [headers] + rows
-            execution_error = None
-        except Exception as e:
-            execution_error = str(e)
-            results = None
-            
-        return jsonify({
-            "status": "success",
-            "sql_query": sql_display,
-            "explanation": explanation,
-            "results": results,
-            "execution_error": execution_error
-        })
+    as_arrow = wants_arrow()
+    if is_schema_question(question):
+        with session_data['lock']:
+            response = schema_query_response(con, table_name, as_arrow)
+        if isinstance(response["results"], pa.Table):
+            return arrow_response(response, "results")
+        return jsonify(response)
 
     # Normal LLM-based query processing
     try:
-        formatted_schema = format_schema_for_prompt(con, table_name)
-
-        llm = ChatGroq(model="llama-3.1-8b-instant", temperature=0, groq_api_key=GROQ_API_KEY)
-
-        prompt_template = ChatPromptTemplate.from_messages(
-            [
-                ("system", 
-                    """
-You are an expert SQL query generator. Your task is to analyze the following natural language question about the table '{table_name}' and provide a single, valid DuckDB SQL query. This query should be a SELECT statement. Also, provide a clear and concise explanation of what the query does.
-
-The table schema is as follows:
-{schema}
-
-Do not return the table schema or PRAGMA queries in the response, even if the user asks for it. The schema has already been provided to you. Only generate SELECT statements.
-
-When referencing a column name that contains a space or other special characters, always enclose the column name in double quotes (").
-
-Respond with a JSON object containing the `sql_query` and `explanation`.
-Example format:
-```json
-{{
-    "sql_query": "SELECT ...",
-    "explanation": "This query does..."
-}}
-```
-                    """),
-                ("human", "Natural language question: {question}")
-            ]
-        )
-        
-        chain = prompt_template | llm
-        response = chain.invoke({
-            "question": question, 
-            "table_name": table_name, 
-            "schema": formatted_schema
-        })
+        formatted_schema = session_data['schema_prompt']
+        cache_key = sql_cache_key(table_name, session_data['schema_hash'], question)
+        generated = match_fast_path(question, table_name, session_data['columns']) or get_cached_sql(cache_key)
 
-        json_match = re.search(r'```json\n(.*?)```', response.content, re.DOTALL)
-        if json_match:
-            generated_json = json_match.group(1).strip()
+        if generated is not None:
+            sql_query, explanation = generated
         else:
-            generated_json = response.content.strip()
+            try:
+                output = SQL_CHAIN.invoke({
+                    "question": question, 
+                    "table_name": table_name, 
+                    "schema": formatted_schema
+                })
+            except OutputParserException as e:
+                output = e.llm_output
+
+            sql_query, explanation = parse_llm_response(output)
+            if "Error" not in sql_query:
+                cache_sql(cache_key, sql_query, explanation)
+
+        with session_data['lock']:
+            response = sql_query_response(con, session_data['result_cache'], sql_query, explanation, execute_sql, as_arrow)
+        if isinstance(response["results"], pa.Table):
+            return arrow_response(response, "results")
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/ask_stream", methods=["POST"])
+def ask_query_stream():
+    """Streams the LLM output as Server-Sent Events, followed by the SQL, explanation, and results."""
+    # Keep the original casing for the LLM; keyword checks are case-insensitive
+    question = request.form.get("question", "")
+    session_id = request.form.get("session_id")
+    execute_sql = request.form.get("execute_sql", "").lower() in TRUE_FORM_VALUES
+
+    session_data = get_session(session_id)
+    if session_data is None:
+        return jsonify({"status": "error", "message": "Session not found. Please upload a dataset first."}), 404
+
+    con = session_data['con']
+    table_name = session_data['table_name']
+
+    def generate():
+        # Schema-related queries bypass the LLM and are sent as a single final event
+        if is_schema_question(question):
+            with session_data['lock']:
+                response = schema_query_response(con, table_name)
+            yield sse_event(response)
+            return
 
         try:
-            parsed_response = json.loads(generated_json)
-            sql_query = parsed_response.get('sql_query', 'Error generating SQL.')
-            explanation = parsed_response.get('explanation', 'Failed to generate a valid explanation.')
-        except json.JSONDecodeError:
-            sql_query = "Error generating SQL."
-            explanation = f"LLM returned invalid JSON. Response was: {generated_json}"
-        
-        results = None
-        execution_error = None
-        if execute_sql and sql_query and "Error" not in sql_query:
-            try:
-                # Execute the query and get the result cursor
-                cursor = con.execute(sql_query)
-                
-                # Get the column names from the cursor's description, which always exists
-                headers = [desc[0] for desc in cursor.description]
-                
-                # Fetch all rows
-                rows = cursor.fetchall()
-                
-                # Combine headers and rows for the final result
-                results = [headers] + rows
-            except Exception as e:
-                execution_error = str(e)
-
-        return jsonify({
-            "status": "success",
-            "sql_query": sql_query,
-            "explanation": explanation,
-            "results": results,
-            "execution_error": execution_error
-        })
+            formatted_schema = session_data['schema_prompt']
+            cache_key = sql_cache_key(table_name, session_data['schema_hash'], question)
+            generated = match_fast_path(question, table_name, session_data['columns']) or get_cached_sql(cache_key)
+
+            if generated is not None:
+                sql_query, explanation = generated
+            else:
+                # The JSON parser yields the partially generated object as tokens arrive
+                output = None
+                raw_output = ""
+                for chunk in SQL_STREAM_CHAIN.stream({
+                    "question": question,
+                    "table_name": table_name,
+                    "schema": formatted_schema
+                }):
+                    raw_output += chunk.get("raw", "")
+                    if "parsed" in chunk:
+                        output = chunk["parsed"]
+                        yield sse_event({"partial": output})
+
+                # Like /ask, report the raw text when nothing could be parsed
+                sql_query, explanation = parse_llm_response(raw_output if output is None else output)
+                if "Error" not in sql_query:
+                    cache_sql(cache_key, sql_query, explanation)
+
+            with session_data['lock']:
+                response = sql_query_response(con, session_data['result_cache'], sql_query, explanation, execute_sql)
+            yield sse_event(response)
+        except Exception as e:
+            yield sse_event({"status": "error", "message": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/ask_batch", methods=["POST"])
+def ask_batch():
+    """Processes several natural language questions at once, sending the LLM calls in parallel."""
+    payload = request.get_json(silent=True) or {}
+    session_id = payload.get("session_id")
+    questions = payload.get("questions")
+    # Accept a JSON boolean or the same strings as the form routes; bool("false") would be True
+    execute_sql = str(payload.get("execute_sql", False)).lower() in TRUE_FORM_VALUES
+
+    session_data = get_session(session_id)
+    if session_data is None:
+        return jsonify({"status": "error", "message": "Session not found. Please upload a dataset first."}), 404
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) for q in questions):
+        return jsonify({"status": "error", "message": "Questions must be a non-empty list of strings."}), 400
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return jsonify({"status": "error", "message": f"A batch may contain at most {MAX_BATCH_QUESTIONS} questions."}), 400
+
+    con = session_data['con']
+    table_name = session_data['table_name']
+    formatted_schema = session_data['schema_prompt']
+
+    try:
+        # Answer schema questions, fast-path questions and cache hits directly. The
+        # rest go to the LLM once per distinct normalized question, keyed like the SQL cache.
+        cache_keys = {q: sql_cache_key(table_name, session_data['schema_hash'], q) for q in questions}
+        generated = {}
+        llm_questions = {}
+        for question in questions:
+            if is_schema_question(question):
+                continue
+            cache_key = cache_keys[question]
+            answer = match_fast_path(question, table_name, session_data['columns']) or get_cached_sql(cache_key)
+            if answer is not None:
+                generated[cache_key] = answer
+            else:
+                llm_questions.setdefault(cache_key, question)
+
+        if llm_questions:
+            outputs = SQL_CHAIN.batch(
+                [{"question": q, "table_name": table_name, "schema": formatted_schema} for q in llm_questions.values()],
+                config={"max_concurrency": BATCH_MAX_CONCURRENCY},
+                return_exceptions=True
+            )
+            for cache_key, output in zip(llm_questions, outputs):
+                if isinstance(output, OutputParserException):
+                    output = output.llm_output
+                elif isinstance(output, Exception):
+                    generated[cache_key] = output
+                    continue
+
+                sql_query, explanation = parse_llm_response(output)
+                if "Error" not in sql_query:
+                    cache_sql(cache_key, sql_query, explanation)
+                generated[cache_key] = (sql_query, explanation)
+
+        # Execute the generated queries one after another on the session connection
+        responses = []
+        with session_data['lock']:
+            for question in questions:
+                if is_schema_question(question):
+                    responses.append(schema_query_response(con, table_name))
+                elif isinstance(generated[cache_keys[question]], Exception):
+                    responses.append({"status": "error", "message": str(generated[cache_keys[question]])})
+                else:
+                    sql_query, explanation = generated[cache_keys[question]]
+                    responses.append(sql_query_response(con, session_data['result_cache'], sql_query, explanation, execute_sql))
+
+        return jsonify({"status": "success", "responses": responses})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -242,25 +814,14 @@ Example format:
 def clear_session():
     """Clears the session data and deletes the temporary files."""
     session_id = request.form.get("session_id")
-    if session_id in db_session:
-        session_data = db_session[session_id]
-        con = session_data['con']
-        con.close()
-        
-        file_path = session_data['file_path']
-        db_file_path = session_data['db_file_path']
-        
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        if os.path.exists(db_file_path):
-            os.remove(db_file_path)
-            
-        del db_session[session_id]
+    session_data = remove_session(session_id) if session_id else None
+    if session_data is not None:
+        close_session(session_data)
         return jsonify({"status": "success", "message": "Session cleared."})
     return jsonify({"status": "error", "message": "Session not found."}), 404
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    app.run(debug=True, host="0.0.0.0", port=port)  # remove parentheses after app
+    app.run(debug=True, host="0.0.0.0", port=port, threaded=True)  # remove parentheses after app
 
 